@@ -1,14 +1,28 @@
 import streamlit as st
 import pandas as pd
+import io
 import os
-import pickle
 import re
+import csv
 import json
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, date
 
+import httplib2
+import orjson
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv as pacsv
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
+from googleapiclient import model as gapi_model
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
 
 ##########################
 # 1) Constants (shared)
@@ -16,81 +30,166 @@ from google.auth.transport.requests import Request
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
 REDIRECT_URI = "https://timetable.vitaphub.in"  # or your domain
 TIMEZONE = "Asia/Kolkata"
+# Timetable columns read from uploads and used to build events
+TIMETABLE_COLUMNS = ["Course", "Slot", "Venue", "Faculty Details"]
+# Rows shown in the uploaded-CSV preview table
+PREVIEW_ROWS = 100
+# Retries for rate-limited/transient Google API failures, with exponential backoff
+NUM_RETRIES = 3
+# Socket timeout (seconds) for Google API connections
+HTTP_TIMEOUT = 30
+# Seconds a cached Calendar client is kept: about one access-token lifetime
+SERVICE_TTL = 3600
 
 # A global weekday_map so day_code -> integer (Mon=0,...,Sun=6)
 weekday_map = {
     "MO": 0, "TU": 1, "WE": 2, "TH": 3, "FR": 4, "SA": 5, "SU": 6
 }
 
+def _parse_mapping(mapping):
+    """Pre-parse each (day_code, "HH:MM", "HH:MM") entry into (day_code, weekday, sh, sm, eh, em)."""
+    parsed = {}
+    for slot_key, entries in mapping.items():
+        parsed[slot_key] = []
+        for (day_code, start_str, end_str) in entries:
+            sh, sm = map(int, start_str.split(":"))
+            eh, em = map(int, end_str.split(":"))
+            parsed[slot_key].append((day_code, weekday_map[day_code], sh, sm, eh, em))
+    return parsed
+
+@st.cache_data(show_spinner=False)
 def load_mappings(file_path):
-    """Helper to read an external JSON file containing 'theory_mapping' and 'lab_mapping'."""
+    """
+    Helper to read an external JSON file containing 'theory_mapping' and 'lab_mapping'.
+    Times are parsed here, once per process, rather than for every event.
+    """
     with open(file_path, "r") as f:
         data = json.load(f)
-    return data["theory_mapping"], data["lab_mapping"]
+    return _parse_mapping(data["theory_mapping"]), _parse_mapping(data["lab_mapping"])
 
 ##########################
 # 2) Google Auth
 ##########################
+def _load_creds(token_json):
+    """Credentials are kept in session_state as their authorized-user JSON, not pickled."""
+    return Credentials.from_authorized_user_info(orjson.loads(token_json), SCOPES)
+
+def _authorized_http(creds):
+    """A keep-alive httplib2 connection that signs requests with creds."""
+    return AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+
+class OrjsonJsonModel(gapi_model.JsonModel):
+    """
+    JsonModel that serializes request bodies with orjson. Non-ASCII bodies go through
+    the stock json.dumps, whose escaped output is what the batch MIME writer expects.
+    """
+    def serialize(self, body_value):
+        out = orjson.dumps(body_value).decode()
+        return out if out.isascii() else super().serialize(body_value)
+
+@st.cache_resource(show_spinner=False, max_entries=64, ttl=SERVICE_TTL)
+def _build_service(token_json):
+    """
+    Build the Calendar client once per token; static_discovery uses the packaged schema.
+    The client keeps its own connection, so calls across reruns reuse it. Clients expire
+    after SERVICE_TTL, so one whose token was dropped doesn't stay in memory.
+    """
+    http = _authorized_http(_load_creds(token_json))
+    return build("calendar", "v3", http=http, model=OrjsonJsonModel(),
+                 cache_discovery=False, static_discovery=True)
+
+@st.cache_data(show_spinner=False)
+def _load_client_config():
+    """Parsed credentials.json, read once per process."""
+    with open("credentials.json", "r") as f:
+        return json.load(f)
+
+def _make_flow():
+    """
+    A fresh OAuth flow built from the cached client config. Flows hold the signed-in
+    user's token, so one is never shared between sessions.
+    """
+    # Checked on every call, so a credentials.json added later is picked up without a restart
+    if not os.path.exists("credentials.json"):
+        st.error("Missing credentials.json!")
+        return None
+    return InstalledAppFlow.from_client_config(_load_client_config(), scopes=SCOPES, redirect_uri=REDIRECT_URI)
+
+# st.query_params replaces the experimental API on newer Streamlit; detect it once
+if hasattr(st, "query_params"):
+    def get_query_param(name):
+        """Value of a single URL query parameter, or None."""
+        return st.query_params.get(name)
+
+    def clear_query_params():
+        """Drop all query parameters from the URL."""
+        st.query_params.clear()
+else:
+    def get_query_param(name):
+        """Value of a single URL query parameter, or None."""
+        return st.experimental_get_query_params().get(name, [None])[0]
+
+    def clear_query_params():
+        """Drop all query parameters from the URL."""
+        st.experimental_set_query_params()
+
 def get_google_calendar_service():
     """Check for ?code=... from Google sign-in or existing token; return a Calendar service if available."""
     if "google_token" in st.session_state:
-        creds = pickle.loads(st.session_state["google_token"])
+        creds = _load_creds(st.session_state["google_token"])
         if creds.expired and creds.refresh_token:
             try:
                 creds.refresh(Request())
-                st.session_state["google_token"] = pickle.dumps(creds)
+                st.session_state["google_token"] = creds.to_json()
             except Exception as e:
                 st.error(f"Could not refresh token: {e}")
                 del st.session_state["google_token"]
                 creds = None
         if creds and creds.valid:
-            return build("calendar", "v3", credentials=creds)
-
-    if not os.path.exists("credentials.json"):
-        st.error("Missing credentials.json!")
-        return None
+            return _build_service(st.session_state["google_token"])
 
-    flow = InstalledAppFlow.from_client_secrets_file(
-        "credentials.json",
-        scopes=SCOPES,
-        redirect_uri=REDIRECT_URI
-    )
-
-    query_params = st.experimental_get_query_params()
-    code = query_params.get("code", [None])[0]
+    code = get_query_param("code")
     if code:
+        flow = _make_flow()
+        if not flow:
+            return None
         try:
             flow.fetch_token(code=code)
             creds = flow.credentials
-            st.session_state["google_token"] = pickle.dumps(creds)
-            st.experimental_set_query_params()  # Clear query params
+            st.session_state["google_token"] = creds.to_json()
+            clear_query_params()
             st.success("Google authentication successful! You may close the sign-in tab.")
-            return build("calendar", "v3", credentials=creds)
+            return _build_service(st.session_state["google_token"])
         except Exception as e:
             st.error(f"Error fetching token: {e}")
+            # A used or expired code can't be exchanged again; don't retry it on every rerun
+            clear_query_params()
             return None
 
     return None
 
-def open_auth_url_in_new_tab():
-    """Generate the OAuth URL, auto-open in new tab, also return fallback link."""
-    if not os.path.exists("credentials.json"):
-        st.error("Missing credentials.json!")
-        return None
-
-    flow = InstalledAppFlow.from_client_secrets_file(
-        "credentials.json",
-        scopes=SCOPES,
-        redirect_uri=REDIRECT_URI
-    )
-    auth_url, _ = flow.authorization_url(prompt="consent", access_type="offline")
-
-    auto_open_script = f"""
+# Opens the sign-in page in a new tab; filled in with the OAuth URL
+OPEN_TAB_SCRIPT = """
     <script>
-        window.open("{auth_url}", "_blank");
+        window.open("{}", "_blank");
     </script>
     """
-    st.markdown(auto_open_script, unsafe_allow_html=True)
+
+def open_auth_url_in_new_tab():
+    """
+    Generate the OAuth URL, auto-open in new tab, also return fallback link.
+    The URL is built once and reused for the rest of this session; sign-in completes
+    in the new tab's own session, so nothing here ever invalidates it.
+    """
+    auth_url = st.session_state.get("_auth_url")
+    if auth_url is None:
+        flow = _make_flow()
+        if not flow:
+            return None
+        auth_url, _ = flow.authorization_url(prompt="consent", access_type="offline")
+        st.session_state["_auth_url"] = auth_url
+
+    st.markdown(OPEN_TAB_SCRIPT.format(auth_url), unsafe_allow_html=True)
 
     link_html = f'<a href="{auth_url}" target="_blank">click here to sign in manually</a>'
     return link_html
@@ -98,41 +197,85 @@ def open_auth_url_in_new_tab():
 ##########################
 # 3) Timetable Extraction
 ##########################
+# One VTOP timetable row: course, type, credits, slot, venue, faculty - department.
+# Runs that stop at a delimiter they can't contain ("(", ")", "-") are possessive, so a
+# malformed paste fails in linear time instead of backtracking through every split.
+COURSE_RE = re.compile(
+    r"(\b\w+\d - [\w\s-]++)\(([\w\s]++)\)"
+    r"[\d\s.]++-\s*+Regular\s*+(\w+)\s*([\w+-]+)\s*-\s*([\w-]+)([\w\s.]++)-\s*+(\w+)",
+    re.IGNORECASE
+)
+# Course types whose name is used as-is, without a "(type)" suffix
+EMBEDDED_TYPES = frozenset({"embedded theory", "embedded lab", "theory only"})
+
 def extract_course_details(text):
     """
     Regex-based parser for lines that match the typical VTOP format.
+    Returns (courses, errors) without touching the UI, so results can be cached.
     """
-    pattern = re.compile(
-        r"(\w+\d+ - [\w\s-]+(?:\s+(?:I|II|III|IV|V|VI|VII|VIII|IX|X))?)\s*\(([\w\s]+)\)\s*"
-        r"[\d\s.]+\s*-\s*Regular\s*([\w\d]+)\s*([\w\d\+\-]+)\s*-\s*([\w\d-]+)\s*([\w\s.]+)\s*-\s*([\w]+)",
-        re.IGNORECASE
-    )
     courses = []
-    for match in pattern.finditer(text):
+    errors = []
+    for match in COURSE_RE.finditer(text):
         try:
-            course_name = match.group(1).strip()
-            course_type = match.group(2).strip()
-            if course_type.lower() in ["embedded theory", "embedded lab", "theory only"]:
-                full_course = course_name
-            else:
-                full_course = f"{course_name} ({course_type})"
-
-            slot = match.group(4).strip()
-            venue = match.group(5).strip()
-            facstr = match.group(6).strip()
-            facdep = match.group(7).strip()
-            faculty = f"{facstr} - {facdep}"
-
+            course_name, course_type, slot, venue, facstr, facdep = (
+                g.strip() for g in match.group(1, 2, 4, 5, 6, 7))
             courses.append({
-                "Course": full_course,
+                "Course": course_name if course_type.lower() in EMBEDDED_TYPES
+                          else f"{course_name} ({course_type})",
                 "Slot": slot,
                 "Venue": venue,
-                "Faculty Details": faculty,
+                "Faculty Details": f"{facstr} - {facdep}",
             })
         except Exception as e:
-            st.error(f"Error processing course: {str(e)}")
+            errors.append(f"Error processing course: {str(e)}")
             continue
-    return courses
+    return courses, errors
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def parse_timetable_text(text):
+    """
+    Pasted timetable text -> (DataFrame, errors). Cached on the text, so reruns from
+    editing the parsed table don't re-run the regex or rebuild the frame.
+    """
+    courses, errors = extract_course_details(text)
+    return pd.DataFrame(courses), errors
+
+@st.cache_data(show_spinner=False)
+def read_timetable_csv(data):
+    """
+    Read an uploaded timetable CSV (raw bytes) with Arrow's multithreaded reader,
+    trimming whitespace from headers and string cells (the old skipinitialspace
+    behaviour). Cached on the bytes, so reruns don't re-parse an unchanged upload.
+    Only the TIMETABLE_COLUMNS are converted, all as strings (no type inference,
+    so a venue like "0101" stays as written). Ragged files that Arrow rejects (rows
+    with missing trailing cells) fall back to pandas, which pads them with "".
+    """
+    # Headers may be space-padded, so match them against the raw header line
+    header_line = data.split(b"\n", 1)[0].rstrip(b"\r").decode("utf-8-sig", errors="replace")
+    header = next(csv.reader([header_line]), [])
+    # First header for each column only: Arrow would return a repeated name's first column twice
+    wanted = []
+    for name in header:
+        if name.strip() in TIMETABLE_COLUMNS and name.strip() not in map(str.strip, wanted):
+            wanted.append(name)
+    try:
+        table = pacsv.read_csv(
+            pa.BufferReader(data),
+            parse_options=pacsv.ParseOptions(ignore_empty_lines=True),
+            convert_options=pacsv.ConvertOptions(
+                include_columns=wanted,
+                column_types={name: pa.string() for name in wanted},
+                strings_can_be_null=False,
+            ),
+        )
+    except pa.ArrowInvalid:
+        df = pd.read_csv(io.BytesIO(data), skipinitialspace=True, dtype=str, keep_default_na=False)
+        df.columns = df.columns.str.strip()
+        return df
+    columns = [pc.utf8_trim_whitespace(col) if pa.types.is_string(col.type) else col
+               for col in table.columns]
+    table = pa.table(columns, names=[name.strip() for name in table.column_names])
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
 
 ##########################
 # 4) Calendar Creation
@@ -140,13 +283,21 @@ def extract_course_details(text):
 def get_or_create_calendar(service, calendar_name, timezone=TIMEZONE):
     if not service:
         return None
-    cals = service.calendarList().list().execute()
+    # calendar name -> id, remembered for the session to skip the list round trip
+    cache = st.session_state.setdefault("_cal_id_cache", {})
+    if calendar_name in cache:
+        return cache[calendar_name]
+
+    cals = service.calendarList().list(fields="items(id,summary)").execute(num_retries=NUM_RETRIES)
     for c in cals.get("items", []):
-        if c.get("summary") == calendar_name:
-            return c.get("id")
+        cache.setdefault(c.get("summary"), c.get("id"))
+    if calendar_name in cache:
+        return cache[calendar_name]
+
     body = {"summary": calendar_name, "timeZone": timezone}
-    new_cal = service.calendars().insert(body=body).execute()
-    return new_cal.get("id")
+    new_cal = service.calendars().insert(body=body).execute(num_retries=NUM_RETRIES)
+    cache[calendar_name] = new_cal.get("id")
+    return cache[calendar_name]
 
 def get_first_date_on_or_after(start_date, target_weekday):
     days_ahead = target_weekday - start_date.weekday()
@@ -154,9 +305,255 @@ def get_first_date_on_or_after(start_date, target_weekday):
         days_ahead += 7
     return start_date + timedelta(days_ahead)
 
+def _resolve_mappings(first_dates, mapping):
+    """
+    Resolve each slot's parsed entries (see load_mappings) once per run into
+    (day_code, first_iso, start_time, end_time): first_dates[weekday] is the ISO
+    date of the first such weekday in the semester, times are "HH:MM:SS".
+    """
+    resolved = {}
+    for slot_key, entries in mapping.items():
+        resolved[slot_key] = [
+            (day_code, first_dates[wd], f"{sh:02d}:{sm:02d}:00", f"{eh:02d}:{em:02d}:00")
+            for (day_code, wd, sh, sm, eh, em) in entries
+        ]
+    return resolved
+
 ##########################
 # 5) Create Events with Skip Logic
 ##########################
+# Google's batch endpoint accepts at most 50 requests per multipart call
+BATCH_SIZE = 50
+# Number of batches sent to Google concurrently
+BATCH_WORKERS = 8
+# Upper bound on progress bar updates per run; each one is a websocket frame
+PROGRESS_UPDATES = 20
+# Slot tokens in an uppercased slot field, e.g. "L1+L2" or "A1 + TA1"
+SLOT_TOKEN_RE = re.compile(r"[A-Z0-9]+")
+# Rows whose course or venue contains any of these (lowercase) markers are not added
+SKIP_COURSE_MARKERS = ("embedded project",)
+SKIP_VENUE_MARKERS = ("nil-onl",)
+
+_thread_http = threading.local()
+
+def _worker_http(service):
+    """
+    httplib2.Http is not thread-safe, so each worker thread keeps its own
+    authorized Http and reuses its keep-alive connection across batches.
+    """
+    creds = service._http.credentials
+    http = getattr(_thread_http, "http", None)
+    if http is None or http.credentials is not creds:
+        http = _authorized_http(creds)
+        _thread_http.http = http
+    return http
+
+def _is_retryable(exception):
+    """
+    Rate limits (429, or 403 *RateLimitExceeded), transient 5xx, and socket timeouts or
+    dropped connections are worth retrying.
+    """
+    if isinstance(exception, (TimeoutError, ConnectionError)):
+        return True
+    if not isinstance(exception, HttpError):
+        return False
+    status = exception.resp.status
+    if status == 403:
+        return b"ratelimitexceeded" in (exception.content or b"").lower()
+    return status in (429, 500, 502, 503, 504)
+
+def _send_batches(service, requests, labels, prog_bar):
+    """
+    Execute requests (request_id -> HttpRequest) in BatchHttpRequests of BATCH_SIZE,
+    BATCH_WORKERS at a time. Items that fail with a retryable error are re-sent with
+    exponential backoff. Returns the error messages; Streamlit calls stay on this thread.
+    """
+    errors = []
+    errors_lock = threading.Lock()
+    pending = list(requests)
+
+    for attempt in range(NUM_RETRIES + 1):
+        retry = []
+
+        def _on_done(request_id, response, exception):
+            if exception is None:
+                return
+            with errors_lock:
+                if attempt < NUM_RETRIES and _is_retryable(exception):
+                    retry.append(request_id)
+                else:
+                    errors.append(f"Error creating event for {labels[request_id]}: {exception}")
+
+        with ThreadPoolExecutor(max_workers=BATCH_WORKERS) as executor:
+            # future -> the request ids in its batch, so a failed batch can be retried or reported
+            futures = {}
+            for start in range(0, len(pending), BATCH_SIZE):
+                ids = pending[start:start + BATCH_SIZE]
+                batch = service.new_batch_http_request(callback=_on_done)
+                for request_id in ids:
+                    batch.add(requests[request_id], request_id=request_id)
+                futures[executor.submit(lambda b: b.execute(http=_worker_http(service)), batch)] = ids
+            step = max(1, len(futures) // PROGRESS_UPDATES)
+            for done, future in enumerate(as_completed(futures), start=1):
+                try:
+                    future.result()
+                except Exception as e:
+                    # The whole multipart request failed, so none of its items were reported
+                    with errors_lock:
+                        if attempt < NUM_RETRIES and _is_retryable(e):
+                            retry.extend(futures[future])
+                        else:
+                            errors.extend(f"Error creating event for {labels[request_id]}: {e}"
+                                          for request_id in futures[future])
+                if done % step == 0:
+                    prog_bar.progress(int((done / len(futures)) * 100))
+
+        if not retry:
+            break
+        time.sleep(2 ** attempt)
+        pending = retry
+
+    return errors
+
+def _find_conflicts(meetings):
+    """
+    Overlapping (day_code, start_time, end_time, summary) meetings, as one warning message
+    per pair of courses. A per-day sweep in start order: each meeting is checked only
+    against those still running.
+    """
+    # (earlier course, later course) -> days they clash on
+    clashes = {}
+    active = {}
+    for (day_code, start_time, end_time, summary) in sorted(meetings):
+        running = [m for m in active.get(day_code, []) if m[1] > start_time]
+        for (other, other_end) in running:
+            if other != summary:
+                clashes.setdefault((other, summary), {})[day_code] = None
+        running.append((summary, end_time))
+        active[day_code] = running
+    return [f"'{first}' overlaps '{second}' on {', '.join(sorted(days, key=weekday_map.get))}."
+            for (first, second), days in clashes.items()]
+
+def build_event_bodies(df, from_date, until_str,
+                       skip_ranges,
+                       theory_mapping, lab_mapping,
+                       notifications=[]):
+    """
+    Turns timetable rows into (course, event_body) pairs for weekly recurring events,
+    skipping entire date ranges in skip_ranges. Makes no Streamlit calls: problems
+    with individual slots, and courses whose meetings overlap, are returned as
+    (warnings, conflicts) messages alongside the events.
+    """
+    events = []
+    warnings = []
+    meetings = []
+
+    overrides = [{"method": "popup", "minutes": m} for m in notifications]
+    reminders = {"useDefault": False, "overrides": overrides}
+
+    # Only 7 possible first occurrences for a fixed semester start
+    first_dates = [get_first_date_on_or_after(from_date, wd).isoformat() for wd in range(7)]
+
+    # One uppercased slot -> resolved entries table, so classifying a slot is a single probe
+    slot_table = {k.upper(): v for k, v in _resolve_mappings(first_dates, theory_mapping).items()}
+    slot_table.update({k.upper(): v for k, v in _resolve_mappings(first_dates, lab_mapping).items()})
+
+    # EXDATE days depend only on the run; recurrence lists are shared per (days, start time)
+    skip_days = [(skip_start + timedelta(days=i)).strftime("%Y%m%dT")
+                 for (skip_start, skip_end) in skip_ranges
+                 for i in range((skip_end - skip_start).days + 1)]
+    recurrences = {}
+
+    # Normalize the columns once with pandas string ops instead of per row
+    raw = (df.reindex(columns=TIMETABLE_COLUMNS, fill_value="")
+             .fillna("").astype(str).reset_index(drop=True))
+    norm = pd.DataFrame({
+        "course": raw["Course"].str.strip(),
+        "slot": raw["Slot"].str.strip(),
+        "venue": raw["Venue"].str.strip(),
+        "faculty": raw["Faculty Details"].str.strip(),
+    })
+    # Skip certain lines
+    skip = (norm["course"].str.lower().str.contains("|".join(map(re.escape, SKIP_COURSE_MARKERS)))
+            | norm["venue"].str.lower().str.contains("|".join(map(re.escape, SKIP_VENUE_MARKERS))))
+    norm = norm[~skip]
+
+    # Tokenize slots in one regex pass. Rows without any slot token have nothing to add.
+    norm = norm.assign(slot_tokens=norm["slot"].str.upper().str.findall(SLOT_TOKEN_RE))
+    norm = norm[norm["slot_tokens"].str.len() > 0]
+
+    rows = zip(norm.index, norm["course"].to_numpy(), norm["slot"].to_numpy(), norm["venue"].to_numpy(),
+               norm["faculty"].to_numpy(), norm["slot_tokens"].to_numpy())
+    for idx, course, slot_field, venue, faculty, slot_tokens in rows:
+        summary = f"{course} [{slot_field}]"
+
+        # Whole slot first (e.g. lab pairs like "L1+L2"), then token by token
+        day_time_pairs = slot_table.get("+".join(slot_tokens))
+        if day_time_pairs is None:
+            day_time_pairs = []
+            for token in slot_tokens:
+                if token in slot_table:
+                    day_time_pairs.extend(slot_table[token])
+                else:
+                    warnings.append(f"Slot '{token}' not found. Skipping row {idx}.")
+
+        # Meetings at the same time of day share one event with a multi-day BYDAY rule,
+        # starting on the earliest of their first occurrences
+        groups = {}
+        for (day_code, first_iso, start_time, end_time) in day_time_pairs:
+            group = groups.setdefault((start_time, end_time), [first_iso, {}])
+            group[0] = min(group[0], first_iso)
+            group[1][day_code] = None
+            meetings.append((day_code, start_time, end_time, summary))
+
+        # Build one event body per time-of-day group
+        for (start_time, end_time), (first_iso, day_codes) in groups.items():
+            byday = ",".join(day_codes)
+            recurrence_lines = recurrences.get((byday, start_time))
+            if recurrence_lines is None:
+                rrule = f"RRULE:FREQ=WEEKLY;BYDAY={byday};UNTIL={until_str}"
+                # EXDATE lines for skip_ranges
+                ex_time = start_time.replace(":", "")
+                recurrence_lines = [rrule] + [f"EXDATE;TZID={TIMEZONE}:{day}{ex_time}"
+                                              for day in skip_days]
+                recurrences[(byday, start_time)] = recurrence_lines
+
+            event_body = {
+                "summary": summary,
+                "location": venue,
+                "description": faculty,
+                "start": {"dateTime": f"{first_iso}T{start_time}", "timeZone": TIMEZONE},
+                "end": {"dateTime": f"{first_iso}T{end_time}", "timeZone": TIMEZONE},
+                "recurrence": recurrence_lines,
+                "reminders": reminders,
+            }
+            events.append((course, event_body))
+
+    return events, warnings, _find_conflicts(meetings)
+
+def _event_bodies_key(df, *params):
+    """Digest of the timetable contents and every parameter the event bodies depend on."""
+    digest = hashlib.blake2b(pd.util.hash_pandas_object(df, index=False).values.tobytes(), digest_size=16)
+    digest.update(orjson.dumps([TIMEZONE, *params], default=str))
+    return digest.digest()
+
+def prepare_event_bodies(df, from_date, until_str,
+                         skip_ranges,
+                         theory_mapping, lab_mapping,
+                         notifications=[]):
+    """
+    build_event_bodies() for these inputs, reused from session_state while they are
+    unchanged, so Step 3 can show warnings and conflicts before anything is sent.
+    """
+    key = _event_bodies_key(df, from_date, until_str, skip_ranges, theory_mapping, lab_mapping, notifications)
+    cached = st.session_state.get("_event_bodies")
+    if cached and cached[0] == key:
+        return cached[1]
+    result = build_event_bodies(df, from_date, until_str, skip_ranges,
+                                theory_mapping, lab_mapping, notifications)
+    st.session_state["_event_bodies"] = (key, result)
+    return result
+
 def create_calendar_events(service, df, calendar_id,
                            from_date, until_str,
                            skip_ranges,
@@ -164,112 +561,34 @@ def create_calendar_events(service, df, calendar_id,
                            notifications=[]):
     """
     Creates weekly recurring events, skipping entire date ranges in skip_ranges.
+    Event bodies come from prepare_event_bodies (already built, and their warnings
+    shown, when Step 3 loaded), then are sent by _send_batches.
     """
     if not service or not calendar_id:
         return False
 
-    overrides = [{"method": "popup", "minutes": m} for m in notifications]
-    reminders = {"useDefault": False, "overrides": overrides}
-
-    total_rows = len(df)
     prog_bar = st.progress(0)
     success = True
 
-    for idx, row in df.iterrows():
-        course = row.get("Course", "").strip()
-        slot_field = row.get("Slot", "").strip()
-        venue = row.get("Venue", "").strip()
-        faculty = row.get("Faculty Details", "").strip()
-
-        # Skip certain lines
-        if "EMBEDDED PROJECT" in course.upper():
-            continue
-        if "NIL-ONL" in venue.upper():
-            continue
-
-        summary = f"{course} [{slot_field}]"
-
-        # Lab vs. theory detection
-        slot_tokens = [tok.strip().upper() for tok in slot_field.split("+") if tok.strip()]
-        is_lab = False
-        lab_key = None
-
-        if slot_field.upper() in lab_mapping:
-            is_lab = True
-            lab_key = slot_field.upper()
-        else:
-            for tok in slot_tokens:
-                if tok in lab_mapping or tok.startswith("L"):
-                    is_lab = True
-                    lab_key = tok
-                    break
-
-        day_time_pairs = []
-        try:
-            if is_lab:
-                mapping = lab_mapping.get(lab_key)
-                if not mapping:
-                    st.warning(f"Lab slot '{lab_key}' not found. Skipping row {idx}.")
-                    continue
-                day_time_pairs = mapping
-            else:
-                # Theory
-                mapping = []
-                for token in slot_tokens:
-                    if token in theory_mapping:
-                        mapping.extend(theory_mapping[token])
-                    else:
-                        st.warning(f"Theory slot '{token}' not found. Skipping row {idx}.")
-                day_time_pairs = mapping
-
-            if not day_time_pairs:
-                continue
-
-            # Build event body for each day/time pair
-            for (day_code, start_str, end_str) in day_time_pairs:
-                try:
-                    sh, sm = map(int, start_str.split(":"))
-                    eh, em = map(int, end_str.split(":"))
-                except:
-                    st.warning(f"Invalid time '{start_str}' or '{end_str}' in row {idx}. Skipping.")
-                    continue
-
-                wd = weekday_map[day_code]
-                first_occ_date = get_first_date_on_or_after(from_date, wd)
-
-                dtstart = datetime.combine(first_occ_date, datetime.min.time()).replace(hour=sh, minute=sm)
-                dtend   = datetime.combine(first_occ_date, datetime.min.time()).replace(hour=eh, minute=em)
-
-                rrule = f"RRULE:FREQ=WEEKLY;BYDAY={day_code};UNTIL={until_str}"
-
-                # EXDATE lines for skip_ranges
-                skip_exdates = []
-                for (skip_start, skip_end) in skip_ranges:
-                    day_count = (skip_end - skip_start).days + 1
-                    for i in range(day_count):
-                        skip_day = skip_start + timedelta(days=i)
-                        ex_str = skip_day.strftime("%Y%m%dT") + f"{sh:02d}{sm:02d}00"
-                        skip_exdates.append(f"EXDATE;TZID={TIMEZONE}:{ex_str}")
-
-                recurrence_lines = [rrule] + skip_exdates
-
-                event_body = {
-                    "summary": summary,
-                    "location": venue,
-                    "description": faculty,
-                    "start": {"dateTime": dtstart.isoformat(), "timeZone": TIMEZONE},
-                    "end":   {"dateTime": dtend.isoformat(),   "timeZone": TIMEZONE},
-                    "recurrence": recurrence_lines,
-                    "reminders": reminders,
-                }
-                service.events().insert(calendarId=calendar_id, body=event_body).execute()
+    try:
+        events, _, _ = prepare_event_bodies(df, from_date, until_str, skip_ranges,
+                                            theory_mapping, lab_mapping, notifications)
+    except Exception as e:
+        st.error(f"Error preparing events: {e}")
+        return False
 
-        except Exception as e:
-            st.error(f"Error creating event for {course}: {str(e)}")
-            success = False
+    # request_id -> insert request, and -> course name so failures can name the row
+    requests = {}
+    labels = {}
+    for request_id, (course, event_body) in enumerate(events):
+        requests[str(request_id)] = service.events().insert(calendarId=calendar_id, body=event_body)
+        labels[str(request_id)] = course
 
-        progress_val = int(((idx + 1) / total_rows) * 100)
-        prog_bar.progress(min(progress_val, 100))
+    errors = _send_batches(service, requests, labels, prog_bar) if requests else []
+    for msg in errors:
+        st.error(msg)
+    if errors:
+        success = False
 
     prog_bar.progress(100)
     return success
@@ -353,11 +672,15 @@ def main():
         if method == "Upload CSV":
             csv_file = st.file_uploader("Upload CSV", type=["csv"])
             if csv_file:
-                df = pd.read_csv(csv_file, skipinitialspace=True)
-                df.columns = [c.strip() for c in df.columns]
-                st.session_state["df"] = df
-                st.write("### CSV Preview")
-                st.dataframe(df)
+                try:
+                    df = read_timetable_csv(csv_file.getvalue())
+                    st.session_state["df"] = df
+                    # Collapsed expanders still ship their contents, so gate on a checkbox
+                    if st.checkbox("Show CSV preview"):
+                        st.write("### CSV Preview")
+                        st.dataframe(df.head(PREVIEW_ROWS))
+                except Exception as e:
+                    st.error(f"Error reading CSV: {e}")
         else:
             text = st.text_area("Paste your timetable text:", height=300)
             st.markdown(
@@ -366,9 +689,10 @@ def main():
 
             if text:
                 try:
-                    courses = extract_course_details(text)
-                    if courses:
-                        df = pd.DataFrame(courses)
+                    df, errors = parse_timetable_text(text)
+                    for error in errors:
+                        st.error(error)
+                    if not df.empty:
                         st.write("### Parsed Data Preview (Editable)")
                         st.info("Optional: Download CSV below to edit offline, then re-upload if needed.")
                         st.warning("Project Courses will not be added, so no need to remove them from the table.")
@@ -441,40 +765,63 @@ def main():
         service = get_google_calendar_service()
         if service:
             st.success("You are authenticated with Google Calendar!")
-            if st.button("Create Schedules (Click Once & Wait)"):
-                if "df" not in st.session_state:
-                    st.error("No timetable data found. Please go back to Step 1.")
+            if st.button("Force refresh calendar list"):
+                st.session_state.get("_cal_id_cache", {}).clear()
+
+            notifs = st.session_state.get("notification_times", [])
+            # Retrieve the chosen batch constraints
+            from_date = st.session_state["SEMESTER_START"]
+            until_str = st.session_state["SEMESTER_END_STR"]
+            skip_ranges = st.session_state["SKIP_RANGES"]
+            tmap = st.session_state["theory_map"]
+            lmap = st.session_state["lab_map"]
+
+            # Check the final timetable before the button, so problems can be fixed first
+            ready = "df" in st.session_state
+            if not ready:
+                st.error("No timetable data found. Please go back to Step 1.")
+            else:
+                try:
+                    _, warnings, conflicts = prepare_event_bodies(st.session_state["df"], from_date, until_str,
+                                                                  skip_ranges, tmap, lmap, notifs)
+                except Exception as e:
+                    st.error(f"Error preparing events: {e}")
+                    ready = False
                 else:
-                    cal_id = get_or_create_calendar(service, "WIN SEM", TIMEZONE)
-                    if cal_id:
-                        df = st.session_state["df"]
-                        notifs = st.session_state.get("notification_times", [])
-
-                        # Retrieve the chosen batch constraints
-                        from_date = st.session_state["SEMESTER_START"]
-                        until_str = st.session_state["SEMESTER_END_STR"]
-                        skip_ranges = st.session_state["SKIP_RANGES"]
-                        tmap = st.session_state["theory_map"]
-                        lmap = st.session_state["lab_map"]
-
-                        ok = create_calendar_events(
-                            service,
-                            df,
-                            cal_id,
-                            from_date=from_date,
-                            until_str=until_str,
-                            skip_ranges=skip_ranges,
-                            theory_mapping=tmap,
-                            lab_mapping=lmap,
-                            notifications=notifs
-                        )
-                        if ok:
-                            st.experimental_set_query_params()  # Clear query params
-                            st.success("Calendar events created successfully!")
-                            if "google_token" in st.session_state:
-                                del st.session_state["google_token"]
-                            st.info("Classes Successfully Added Into Your Google Calendar")
-                            st.info("Open Google Calendar App using the same account used here.")
+                    for msg in warnings:
+                        st.warning(msg)
+                    for msg in conflicts:
+                        st.warning(msg)
+                    if conflicts:
+                        st.info("Go back to Step 1 to fix the timetable, or confirm below to add it as is.")
+                        ready = st.checkbox("Add overlapping classes anyway")
+
+            if st.button("Create Schedules (Click Once & Wait)", disabled=not ready):
+                cal_id = get_or_create_calendar(service, "WIN SEM", TIMEZONE)
+                if cal_id:
+                    df = st.session_state["df"]
+
+                    ok = create_calendar_events(
+                        service,
+                        df,
+                        cal_id,
+                        from_date=from_date,
+                        until_str=until_str,
+                        skip_ranges=skip_ranges,
+                        theory_mapping=tmap,
+                        lab_mapping=lmap,
+                        notifications=notifs
+                    )
+                    if ok:
+                        clear_query_params()
+                        st.success("Calendar events created successfully!")
+                        if "google_token" in st.session_state:
+                            del st.session_state["google_token"]
+                        # The next sign-in may be a different account
+                        st.session_state.pop("_cal_id_cache", None)
+                        st.session_state.pop("_event_bodies", None)
+                        st.info("Classes Successfully Added Into Your Google Calendar")
+                        st.info("Open Google Calendar App using the same account used here.")
         else:
             st.warning("Not authenticated. Go back to Step 1 to sign in.")
         st.stop()